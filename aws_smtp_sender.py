@@ -1,16 +1,27 @@
 #!/usr/bin/env python3
 import smtplib
 import argparse
+import re
 import time
+import heapq
+import ssl
+import socket
+import itertools
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from email.generator import BytesGenerator
+from email import policy
+import io
 from concurrent.futures import ThreadPoolExecutor
 import threading
-from queue import Queue
+import atexit
+import collections
+import uuid
 import os
 from dotenv import load_dotenv
 import boto3
 from botocore.exceptions import ClientError
+from botocore.config import Config
 
 print("""
 ---------------------------
@@ -21,9 +32,127 @@ AWS SMTP Bulk Email Sender
 # Load environment variables from .env file
 load_dotenv()
 
+# Minimum seconds between two SES account status checks
+SES_STATUS_TTL = 30
+
+# Port on which SMTP servers expect implicit TLS (SMTPS)
+SMTPS_PORT = 465
+
+# Seconds before a stalled SMTP connect or reply is given up on
+SMTP_TIMEOUT = 30
+
+# Idle seconds after which a cached connection is health checked before reuse
+SMTP_IDLE_CHECK = 5
+
+# Idle seconds before TCP keepalive probes start on reused connections
+TCP_KEEPIDLE_SECONDS = 30
+
+# Seconds between two progress line refreshes
+PROGRESS_INTERVAL = 1
+
+# Most destinations SES accepts in one SendBulkTemplatedEmail call
+SES_BULK_BATCH_SIZE = 50
+
+# Worker threads spend their time blocked on sockets, a small stack is plenty
+WORKER_STACK_SIZE = 512 * 1024
+
+def _prepare_socket(server):
+    # Disable Nagle so short SMTP commands go out immediately, and keep idle
+    # connections alive between bursts
+    sock = server.sock
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, TCP_KEEPIDLE_SECONDS)
+
+# server|port|username|password|region per line, extra fields are ignored; fields are
+# taken as-is (empty ones included) and only the line itself is stripped, like str.split
+_SMTP_RE = re.compile(
+    r'^[ \t]*([^|\r\n]*)\|([^|\r\n]*)\|([^|\r\n]*)\|([^|\r\n]*)\|([^|\r\n]*?)(?:\|[^\r\n]*|[ \t]*)$', re.M)
+
+class _ResolvedAddressMixin:
+    # Connect to an address resolved up front instead of looking the host up again,
+    # the host name is still used for TLS verification
+    def __init__(self, host, port, address=None, **kwargs):
+        self._address = address
+        super().__init__(host, port, **kwargs)
+
+    def _get_socket(self, host, port, timeout):
+        if self._address is not None:
+            try:
+                sock = socket.create_connection(self._address[:2], timeout, self.source_address)
+            except OSError:
+                sock = None  # The address may have gone stale, resolve the name instead
+            if sock is not None:
+                # TLS errors are not retried by name, they would fail the same way
+                try:
+                    return self._wrap_socket(sock)
+                except Exception:
+                    sock.close()
+                    raise
+        return super()._get_socket(host, port, timeout)
+
+class ResolvedSMTP(_ResolvedAddressMixin, smtplib.SMTP):
+    def _wrap_socket(self, sock):
+        return sock
+
+class ResolvedSMTP_SSL(_ResolvedAddressMixin, smtplib.SMTP_SSL):
+    def _wrap_socket(self, sock):
+        return self.context.wrap_socket(sock, server_hostname=self._host)
+
+class ResumingSSLContext(ssl.SSLContext):
+    # Offer the last TLS session of a host and port on reconnect so the handshake can be resumed
+    def __init__(self, *args, **kwargs):
+        self._sessions = {}
+
+    def remember_session(self, hostname, ssl_sock):
+        if ssl_sock.session is not None:
+            self._sessions[(hostname, ssl_sock.getpeername()[1])] = ssl_sock.session
+
+    def wrap_socket(self, sock, *args, server_hostname=None, session=None, **kwargs):
+        if session is None and server_hostname is not None:
+            session = self._sessions.get((server_hostname, sock.getpeername()[1]))
+        return super().wrap_socket(sock, *args, server_hostname=server_hostname, session=session, **kwargs)
+
+def _create_ssl_context():
+    # Match ssl.create_default_context(), including the stricter verify flags of newer Pythons
+    default = ssl.create_default_context()
+    context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.options = default.options
+    context.verify_flags = default.verify_flags
+    context.load_default_certs(ssl.Purpose.SERVER_AUTH)
+    return context
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def _escape_handlebars(text):
+    return text.replace('{{', '\\{{')
+
+def _resolve_address(host, port):
+    try:
+        return socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_STREAM)[0][4]
+    except (socket.gaierror, IndexError):
+        return None
+
+def _is_connection_error(error):
+    # smtplib's exceptions derive from OSError, only these mean the connection is gone
+    return (isinstance(error, smtplib.SMTPServerDisconnected) or
+            (isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)))
+
+class SendingPausedError(Exception):
+    pass
+
 class SESStatusChecker:
-    def __init__(self, region):
-        self.ses_client = boto3.client('ses', region_name=region)
+    def __init__(self, region, max_connections=10):
+        # One pooled HTTPS connection per worker so API batches keep their connections alive
+        self.ses_client = boto3.client('ses', region_name=region,
+                                       config=Config(max_pool_connections=max_connections))
         
     def check_sending_enabled(self):
         try:
@@ -34,64 +163,81 @@ class SESStatusChecker:
             return False
 
 class SMTPRotator:
-    def __init__(self, smtp_file):
+    def __init__(self, smtp_file, max_connections=10):
         self.smtp_servers = []
-        self.current_index = 0
         self.lock = threading.Lock()
         self.load_smtp_servers(smtp_file)
+        # Heap of (count, last_used, index), the least used server is always on top
+        self._heap = [(0, 0.0, i) for i in range(len(self.smtp_servers))]
         # Use the region from the first SMTP server for SES client
-        self.status_checker = SESStatusChecker(self.smtp_servers[0]['region']) if self.smtp_servers else None
+        self.status_checker = SESStatusChecker(self.smtp_servers[0]['region'], max_connections) if self.smtp_servers else None
+        # SES status is checked before the first send and again only after a pause was seen
+        self._status_lock = threading.Lock()
+        self._status_checked_at = float('-inf')
+        self._status_suspect = True
+        self._sending_enabled = True
         
     def load_smtp_servers(self, smtp_file):
         try:
+            addresses = {}
             with open(smtp_file, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line:
-                        parts = line.split('|')
-                        if len(parts) >= 5:  # Now expecting 5 parts including region
-                            server, port, username, password, region = parts[:5]
-                            self.smtp_servers.append({
-                                'server': server,
-                                'port': int(port),
-                                'username': username,
-                                'password': password,
-                                'region': region,
-                                'count': 0,
-                                'disabled': False
-                            })
+                data = f.read()
+            for match in _SMTP_RE.finditer(data):
+                server, port, username, password, region = match.groups()
+                port = int(port)
+                # Resolve each endpoint once so connections skip DNS
+                if (server, port) not in addresses:
+                    addresses[(server, port)] = _resolve_address(server, port)
+                self.smtp_servers.append({
+                    'server': server,
+                    'port': port,
+                    'address': addresses[(server, port)],
+                    'username': username,
+                    'password': password,
+                    'region': region,
+                    'count': 0,
+                    'disabled': False
+                })
             if not self.smtp_servers:
                 raise ValueError("No valid SMTP servers found in the file")
         except Exception as e:
             print(f"Error loading SMTP servers: {str(e)}")
             exit(1)
 
+    def ensure_sending_enabled(self):
+        if self._status_suspect and time.monotonic() - self._status_checked_at >= SES_STATUS_TTL:
+            with self._status_lock:
+                if self._status_suspect and time.monotonic() - self._status_checked_at >= SES_STATUS_TTL:
+                    self._sending_enabled = self.status_checker.check_sending_enabled()
+                    self._status_checked_at = time.monotonic()
+                    self._status_suspect = False
+                    
+        if not self._sending_enabled:
+            raise SendingPausedError("AWS SES sending is currently paused for your account")
+
+    @property
+    def sending_paused(self):
+        return not self._sending_enabled
+
     def get_next_server(self):
+        # First check SES sending status, outside the rotation lock
+        self.ensure_sending_enabled()
+        
         with self.lock:
-            # First check SES sending status
-            if not self.status_checker.check_sending_enabled():
-                print("\nERROR: AWS SES sending is currently paused for your account.")
-                print("Please check your AWS SES dashboard and verify your sending limits.")
-                exit(1)
-                
-            # Find the next available server with count < 3 and not disabled
-            for _ in range(len(self.smtp_servers)):
-                server = self.smtp_servers[self.current_index]
+            while self._heap:
+                count, _, index = heapq.heappop(self._heap)
+                server = self.smtp_servers[index]
                 
+                # Disabled servers simply drop out of the rotation
                 if server['disabled']:
-                    self.current_index = (self.current_index + 1) % len(self.smtp_servers)
                     continue
                     
-                if server['count'] < 3:
-                    server['count'] += 1
-                    return server
-                    
-                self.current_index = (self.current_index + 1) % len(self.smtp_servers)
-                server['count'] = 0  # Reset counter if we've tried all servers
+                # Taking the least used server, oldest first on ties, is plain round-robin
+                server['count'] = count + 1
+                heapq.heappush(self._heap, (count + 1, time.monotonic(), index))
+                return server
                 
-            # If all servers have count >= 3, wait and try again
-            time.sleep(1)
-            return self.get_next_server()
+            raise RuntimeError("All SMTP servers are disabled")
 
     def disable_server(self, server_info):
         with self.lock:
@@ -101,8 +247,31 @@ class SMTPRotator:
                     server['username'] == server_info['username'] and
                     server['region'] == server_info['region']):
                     server['disabled'] = True
+                    self.report_sending_paused()
                     print(f"\nDisabled server: {server['server']} due to sending pause")
 
+    def report_sending_paused(self):
+        # Re-check the SES account status before the next send
+        self._status_suspect = True
+
+    def partition(self, email_list, workers):
+        # One shard per worker, each pinned to a single server so its connection is reused
+        active = [server for server in self.smtp_servers if not server['disabled']]
+        if not active:
+            return []
+        # Every server gets an equal share of recipients, split among its workers;
+        # leftover workers go to the first servers
+        base, extra = divmod(workers, len(active))
+        shards = []
+        for i, server in enumerate(active):
+            recipients = email_list[i::len(active)]
+            server_workers = max(1, base + (1 if i < extra else 0))
+            for j in range(server_workers):
+                shard = recipients[j::server_workers]
+                if shard:
+                    shards.append((server, shard))
+        return shards
+
 class EmailSender:
     def __init__(self, smtp_rotator, email_list, subject, message, mail_from, html_message=None):
         self.smtp_rotator = smtp_rotator
@@ -113,54 +282,299 @@ class EmailSender:
         self.html_message = html_message
         self.success_count = 0
         self.failure_count = 0
-        self.lock = threading.Lock()
-        self.progress_queue = Queue()
-        
-    def send_email(self, recipient):
-        smtp_info = self.smtp_rotator.get_next_server()
-        msg = MIMEMultipart('alternative')
+        self._count_lock = threading.Lock()
+        # Only failures are reported, deque.append is atomic so workers need no lock
+        self._failures = collections.deque()
+        self.progress_condition = threading.Condition()
+        # Persistent SMTP connections, cached per worker thread
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        atexit.register(self.close_connections)
+        # Creating an SSL context is expensive, share one across all connections,
+        # it also keeps the TLS sessions used to resume handshakes on reconnect
+        self._ssl_context = _create_ssl_context()
+        self._message_bytes = self._build_message()
+
+    def _build_message(self):
+        if self.html_message:
+            # Attach both plain text and HTML versions
+            msg = MIMEMultipart('alternative', policy=policy.SMTP)
+            part1 = MIMEText(self.message, 'plain', policy=policy.SMTP)
+            msg.attach(part1)
+            part2 = MIMEText(self.html_message, 'html', policy=policy.SMTP)
+            msg.attach(part2)
+        else:
+            # Plain text alone needs no multipart wrapper or boundary
+            msg = MIMEText(self.message, 'plain', policy=policy.SMTP)
         msg['From'] = self.mail_from
-        msg['To'] = recipient
         msg['Subject'] = self.subject
         
-        # Attach both plain text and HTML versions
-        part1 = MIMEText(self.message, 'plain')
-        msg.attach(part1)
+        # The SMTP policy writes CRLF line endings, which smtplib expects for bytes
+        buffer = io.BytesIO()
+        BytesGenerator(buffer, policy=policy.SMTP).flatten(msg)
+        return buffer.getvalue()
+
+    def _connect(self, smtp_info):
+        if smtp_info['port'] == SMTPS_PORT:
+            # Implicit TLS saves the EHLO/STARTTLS/EHLO exchange
+            server = ResolvedSMTP_SSL(smtp_info['server'], smtp_info['port'], smtp_info['address'],
+                                      timeout=SMTP_TIMEOUT, context=self._ssl_context)
+        else:
+            server = ResolvedSMTP(smtp_info['server'], smtp_info['port'], smtp_info['address'],
+                                  timeout=SMTP_TIMEOUT)
+        try:
+            _prepare_socket(server)
+            if not isinstance(server, smtplib.SMTP_SSL):
+                server.starttls(context=self._ssl_context)
+            server.login(smtp_info['username'], smtp_info['password'])
+            # TLS 1.3 session tickets only arrive after the handshake, so store the session now
+            self._ssl_context.remember_session(smtp_info['server'], server.sock)
+        except Exception:
+            server.close()
+            raise
+        with self._connections_lock:
+            self._connections.append(server)
+        return server
+
+    def _discard_connection(self, key):
+        server = self._local.connections.pop(key, None)
+        self._local.last_used.pop(key, None)
+        if server is None:
+            return
+        with self._connections_lock:
+            if server in self._connections:
+                self._connections.remove(server)
+        try:
+            server.close()
+        except Exception:
+            pass
+
+    def _get_connection(self, smtp_info):
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = {}
+            self._local.last_used = {}
+        key = (smtp_info['server'], smtp_info['port'], smtp_info['username'])
+        server = self._local.connections.get(key)
+        now = time.monotonic()
+        if server is not None:
+            # Busy connections are trusted, send_email retries on a fresh one if they broke;
+            # only ones left idle for a while are health checked first
+            if now - self._local.last_used[key] < SMTP_IDLE_CHECK:
+                self._local.last_used[key] = now
+                return key, server, True
+            try:
+                code, _ = server.noop()
+                if code == 250:
+                    self._local.last_used[key] = now
+                    return key, server, True
+            except (smtplib.SMTPServerDisconnected, OSError):
+                pass
+            self._discard_connection(key)
+        server = self._connect(smtp_info)
+        self._local.connections[key] = server
+        self._local.last_used[key] = time.monotonic()
+        return key, server, False
+
+    @staticmethod
+    def _rset(server):
+        try:
+            server.rset()
+        except smtplib.SMTPServerDisconnected:
+            pass
+
+    def _sendmail(self, server, recipient, message):
+        # Tells send_email whether a retry could deliver the message twice
+        self._local.data_accepted = False
+        if server.has_extn('pipelining'):
+            # RFC 2920: send MAIL, RCPT and DATA in one write and read the replies afterwards
+            server.send(("MAIL FROM:%s\r\nRCPT TO:%s\r\nDATA\r\n" % (
+                smtplib.quoteaddr(self.mail_from), smtplib.quoteaddr(recipient))).encode())
+            mail_code, mail_resp = server.getreply()
+            rcpt_code, rcpt_resp = server.getreply()
+            data_code, data_resp = server.getreply()
+        else:
+            mail_code, mail_resp = server.mail(self.mail_from)
+            rcpt_code, rcpt_resp = server.rcpt(recipient) if mail_code == 250 else (None, None)
+            data_code, data_resp = server.docmd("DATA") if rcpt_code in (250, 251) else (None, None)
         
+        rejected = mail_code != 250 or rcpt_code not in (250, 251)
+        if rejected and data_code == 354:
+            # RFC 2920 3.1: end the unwanted DATA with an empty body, then reset
+            server.send(b".\r\n")
+            server.getreply()
+        if rejected or data_code != 354:
+            self._rset(server)
+        if mail_code != 250:
+            raise smtplib.SMTPSenderRefused(mail_code, mail_resp, self.mail_from)
+        if rcpt_code not in (250, 251):
+            raise smtplib.SMTPRecipientsRefused({recipient: (rcpt_code, rcpt_resp)})
+        if data_code != 354:
+            raise smtplib.SMTPDataError(data_code, data_resp)
+        
+        self._local.data_accepted = True
+        data = re.sub(br'(?m)^\.', b'..', message)
+        if not data.endswith(b"\r\n"):
+            data += b"\r\n"
+        server.send(data + b".\r\n")
+        code, resp = server.getreply()
+        if code != 250:
+            self._rset(server)
+            raise smtplib.SMTPDataError(code, resp)
+
+    def close_connections(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for server in connections:
+            try:
+                server.quit()
+            except Exception:
+                try:
+                    server.close()
+                except Exception:
+                    pass
+
+    def create_template(self):
+        # The message is static, so upload it once as a template without placeholders;
+        # SES renders templates with Handlebars, so literal braces are escaped
+        self._template_name = f"aws-sender-{uuid.uuid4().hex}"
+        template = {
+            'TemplateName': self._template_name,
+            'SubjectPart': _escape_handlebars(self.subject),
+            'TextPart': _escape_handlebars(self.message)
+        }
         if self.html_message:
-            part2 = MIMEText(self.html_message, 'html')
-            msg.attach(part2)
+            template['HtmlPart'] = _escape_handlebars(self.html_message)
+        self.smtp_rotator.status_checker.ses_client.create_template(Template=template)
+
+    def delete_template(self):
+        try:
+            self.smtp_rotator.status_checker.ses_client.delete_template(TemplateName=self._template_name)
+        except ClientError as e:
+            print(f"Error deleting SES template {self._template_name}: {e}")
+
+    def send_api_batch(self, recipients):
+        try:
+            self.smtp_rotator.ensure_sending_enabled()
+            response = self.smtp_rotator.status_checker.ses_client.send_bulk_templated_email(
+                Source=self.mail_from,
+                Template=self._template_name,
+                DefaultTemplateData='{}',
+                Destinations=[{'Destination': {'ToAddresses': [recipient]}} for recipient in recipients]
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'AccountSendingPausedException':
+                self.smtp_rotator.report_sending_paused()
+            for recipient in recipients:
+                self._record_failure(recipient, str(e))
+            return
+        except Exception as e:
+            for recipient in recipients:
+                self._record_failure(recipient, str(e))
+            return
+            
+        # Statuses come back in the same order as the destinations
+        for recipient, status in zip(recipients, response['Status']):
+            if status['Status'] == 'Success':
+                self._record_success()
+            else:
+                self._record_failure(recipient, f"{status['Status']}: {status.get('Error', '')}")
+
+    def send_batch(self, smtp_info, recipients):
+        for recipient in recipients:
+            # Once the shard's server is paused the rotator picks a replacement
+            self.send_email(recipient, None if smtp_info['disabled'] else smtp_info)
+
+    def send_email(self, recipient, smtp_info=None):
+        # Only the To header differs between recipients
+        message = b"To: " + recipient.encode() + b"\r\n" + self._message_bytes
         
+        key = None
         try:
-            with smtplib.SMTP(smtp_info['server'], smtp_info['port']) as server:
-                server.starttls()
-                server.login(smtp_info['username'], smtp_info['password'])
-                server.sendmail(self.mail_from, recipient, msg.as_string())
+            if smtp_info is None:
+                smtp_info = self.smtp_rotator.get_next_server()
+            else:
+                self.smtp_rotator.ensure_sending_enabled()
+            key, server, reused = self._get_connection(smtp_info)
+            try:
+                self._sendmail(server, recipient, message)
+            except OSError as e:
+                # The server may have closed a cached connection, retry once on a fresh
+                # one unless the message body was already handed over
+                if not (reused and _is_connection_error(e)) or self._local.data_accepted:
+                    raise
+                self._discard_connection(key)
+                key, server, _ = self._get_connection(smtp_info)
+                self._sendmail(server, recipient, message)
             
-            with self.lock:
-                self.success_count += 1
-            self.progress_queue.put((recipient, True, None))
+            self._record_success()
         except smtplib.SMTPResponseException as e:
             if e.smtp_code == 454 and "Sending paused for this account" in str(e):
                 self.smtp_rotator.disable_server(smtp_info)
-            with self.lock:
-                self.failure_count += 1
-            self.progress_queue.put((recipient, False, str(e)))
+            # 421 means the server is closing the connection
+            if key is not None and e.smtp_code == 421:
+                self._discard_connection(key)
+            self._record_failure(recipient, str(e))
         except Exception as e:
-            with self.lock:
-                self.failure_count += 1
-            self.progress_queue.put((recipient, False, str(e)))
+            # Drop broken connections so the next send reconnects
+            if key is not None and _is_connection_error(e):
+                self._discard_connection(key)
+            self._record_failure(recipient, str(e))
+    
+    def write_failures(self, log_file):
+        # Stream failures to the log as they arrive, a None item ends the stream
+        while True:
+            with self.progress_condition:
+                self.progress_condition.wait_for(lambda: self._failures)
+            while self._failures:
+                item = self._failures.popleft()
+                if item is None:
+                    return
+                recipient, error = item
+                log_file.write(f"{recipient}: {error}\n")
+    
+    def end_failures(self):
+        self._failures.append(None)
+        self._notify_progress()
+    
+    def _record_success(self):
+        with self._count_lock:
+            self.success_count += 1
+    
+    def _record_failure(self, recipient, error):
+        with self._count_lock:
+            self.failure_count += 1
+        self._failures.append((recipient, error))
+        # Wake the failure log writer
+        self._notify_progress()
+    
+    def finish_progress(self):
+        # Called once the pool has drained so the final progress line prints right away
+        self._notify_progress()
+    
+    def _notify_progress(self):
+        with self.progress_condition:
+            self.progress_condition.notify_all()
     
     def display_progress(self, total):
-        while self.success_count + self.failure_count < total:
-            time.sleep(0.5)
-            print(f"\rProgress: {self.success_count + self.failure_count}/{total} | Success: {self.success_count} | Failed: {self.failure_count}", end='')
+        done = shown = 0
+        while done < total:
+            # Refresh once per interval, or right away when the last email completes
+            with self.progress_condition:
+                self.progress_condition.wait_for(
+                    lambda: self.success_count + self.failure_count >= total, timeout=PROGRESS_INTERVAL)
+            success, failure = self.success_count, self.failure_count
+            done = success + failure
+            if done != shown:
+                print(f"\rProgress: {done}/{total} | Success: {success} | Failed: {failure}", end='', flush=True)
+                shown = done
         print()  # New line after completion
 
 def load_email_list(email_file):
     try:
         with open(email_file, 'r') as f:
-            return [line.strip() for line in f if line.strip()]
+            # Split and strip in C instead of iterating the file line by line
+            return [line for line in map(str.strip, f.read().splitlines()) if line]
     except Exception as e:
         print(f"Error loading email list: {str(e)}")
         exit(1)
@@ -174,7 +588,9 @@ def get_config_from_env():
         'message_file': os.getenv('MESSAGE_FILE'),
         'html_message_file': os.getenv('HTML_MESSAGE_FILE'),
         'threads': os.getenv('THREADS', '5'),
-        'mail_from': os.getenv('MAIL_FROM')
+        'mail_from': os.getenv('MAIL_FROM'),
+        'failed_log': os.getenv('FAILED_LOG', 'failed.txt'),
+        'transport': os.getenv('TRANSPORT', 'smtp')
     }
     
     # Validate required configurations
@@ -191,6 +607,10 @@ def get_config_from_env():
         print("Error: THREADS must be an integer")
         exit(1)
         
+    if config['transport'] not in ('smtp', 'api'):
+        print("Error: TRANSPORT must be either smtp or api")
+        exit(1)
+        
     return config
 
 def main():
@@ -203,6 +623,9 @@ def main():
     parser.add_argument('--html-message-file', help='Optional file containing HTML email message')
     parser.add_argument('--threads', type=int, help='Number of concurrent threads')
     parser.add_argument('--mail-from', help='Email address to send from (must be verified in AWS SES)')
+    parser.add_argument('--failed-log', help='File to write failed deliveries to (default: failed.txt)')
+    parser.add_argument('--transport', choices=['smtp', 'api'],
+                        help='Send through SMTP, or through the SES SendBulkTemplatedEmail API (default: smtp)')
     
     args = parser.parse_args()
     
@@ -217,6 +640,8 @@ def main():
     html_message_file = args.html_message_file or env_config['html_message_file']
     threads = args.threads or env_config['threads']
     mail_from = args.mail_from or env_config['mail_from']
+    failed_log_file = args.failed_log or env_config['failed_log']
+    transport = args.transport or env_config['transport']
     
     # Load messages
     try:
@@ -240,7 +665,7 @@ def main():
     total_emails = len(email_list)
     
     # Initialize SMTP rotator
-    smtp_rotator = SMTPRotator(smtp_file)
+    smtp_rotator = SMTPRotator(smtp_file, threads)
     
     # Get AWS region from the first SMTP server
     aws_region = smtp_rotator.smtp_servers[0]['region'] if smtp_rotator.smtp_servers else 'us-east-1'
@@ -252,29 +677,90 @@ Configuration Summary:
 - Recipients: {total_emails}
 - Subject: {subject}
 - From Address: {mail_from}
+- Transport: {transport}
 - Threads: {threads}
 - Message File: {message_file}
 - HTML Message File: {html_message_file or 'None'}
+- Failed Log File: {failed_log_file}
 """)
     
+    # Check SES sending status once before any worker starts
+    try:
+        smtp_rotator.ensure_sending_enabled()
+    except SendingPausedError:
+        print("\nERROR: AWS SES sending is currently paused for your account.")
+        print("Please check your AWS SES dashboard and verify your sending limits.")
+        exit(1)
+    
     # Initialize email sender
     email_sender = EmailSender(smtp_rotator, email_list, subject, message, mail_from, html_message)
     
+    if transport == 'api':
+        try:
+            email_sender.create_template()
+        except ClientError as e:
+            print(f"Error creating SES template: {e}")
+            exit(1)
+    
+    # Opened only once startup succeeded so a failed start keeps the previous log
+    try:
+        failed_log = open(failed_log_file, 'w', buffering=1 << 16)
+    except Exception as e:
+        print(f"Error opening failed log file: {str(e)}")
+        if transport == 'api':
+            email_sender.delete_template()
+        exit(1)
+    
     # Start progress display thread
     progress_thread = threading.Thread(target=email_sender.display_progress, args=(total_emails,))
     progress_thread.daemon = True
     progress_thread.start()
     
+    # Start failure log writer thread
+    failures_thread = threading.Thread(target=email_sender.write_failures, args=(failed_log,))
+    failures_thread.daemon = True
+    failures_thread.start()
+    
     # Start sending emails
     start_time = time.time()
     print("Starting email sending process...\n")
     
-    with ThreadPoolExecutor(max_workers=threads) as executor:
-        executor.map(email_sender.send_email, email_list)
+    threading.stack_size(WORKER_STACK_SIZE)
+    executor = ThreadPoolExecutor(max_workers=threads)
+    futures = []
+    try:
+        if transport == 'api':
+            # One HTTPS request per batch over botocore's pooled connections
+            for recipients in _batched(email_list, SES_BULK_BATCH_SIZE):
+                futures.append(executor.submit(email_sender.send_api_batch, recipients))
+        else:
+            for smtp_info, recipients in smtp_rotator.partition(email_list, threads):
+                futures.append(executor.submit(email_sender.send_batch, smtp_info, recipients))
+        executor.shutdown(wait=True)
+    except BaseException:
+        # On errors or Ctrl-C drop the queued tasks and let running ones finish
+        # before their connections and the template are cleaned up
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    finally:
+        # Never leave the temporary template behind
+        email_sender.close_connections()
+        if transport == 'api':
+            email_sender.delete_template()
+    
+    # Tasks handle delivery errors themselves, anything else would otherwise go unnoticed
+    for future in futures:
+        if future.exception() is not None:
+            print(f"\nError in sending task: {future.exception()}")
     
-    # Wait for progress thread to finish
-    while email_sender.success_count + email_sender.failure_count < total_emails:
-        time.sleep(0.5)
+    # All tasks are done once the executor exits, let the progress line catch up
+    email_sender.finish_progress()
+    progress_thread.join(timeout=1)
+    
+    # Flush the remaining failures to the log
+    email_sender.end_failures()
+    failures_thread.join()
+    failed_log.close()
     
     # Print summary
     print("\nEmail sending completed!")
@@ -282,13 +768,14 @@ Configuration Summary:
     print(f"Successfully sent: {email_sender.success_count}")
     print(f"Failed to send: {email_sender.failure_count}")
     
-    # Print failures if any
+    # A pause seen mid-run fails the remaining recipients instead of sending them
+    if smtp_rotator.sending_paused:
+        print("\nERROR: AWS SES sending was paused for your account during the run.")
+        print("Please check your AWS SES dashboard and verify your sending limits.")
+    
+    # Point to the failures if any
     if email_sender.failure_count > 0:
-        print("\nFailed deliveries:")
-        while not email_sender.progress_queue.empty():
-            recipient, success, error = email_sender.progress_queue.get()
-            if not success:
-                print(f"{recipient}: {error}")
+        print(f"\nFailed deliveries written to: {failed_log_file}")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file